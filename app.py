@@ -1,14 +1,23 @@
 import streamlit as st
-import pandas as pd
 import pydeck as pdk
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
-import math
-import time
 import numpy as np
 from datetime import date
 import datetime
+import calendar
+from types import MappingProxyType
+
+try:
+    import orjson
+    json_dumps, json_loads = orjson.dumps, orjson.loads
+except ImportError: # Fall back to the stdlib encoder if orjson isn't installed
+    import json
+    def json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
 
 # ==========================================
 # 1. CONFIGURATION & STYLING
@@ -20,7 +29,7 @@ st.set_page_config(
 )
 
 # Force Dark Theme & Custom CSS
-st.markdown("""
+APP_CSS = """
     <style>
     /* Main Background - Dark */
     .stApp {
@@ -50,7 +59,8 @@ st.markdown("""
         color: #e2e8f0;
     }
     </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # ==========================================
 # 2. CREDENTIALS & DATA SETUP
@@ -60,6 +70,25 @@ st.markdown("""
 DATABRICKS_URL = os.environ.get("DATABRICKS_URL")
 DATABRICKS_TOKEN = os.environ.get("DATABRICKS_TOKEN")
 
+# Read-only headers for every Databricks request (None when the token is missing)
+HEADERS = MappingProxyType({
+    "Authorization": f"Bearer {DATABRICKS_TOKEN}",
+    "Content-Type": "application/json"
+}) if DATABRICKS_TOKEN else None
+
+# Feature columns expected by the model, in order
+PAYLOAD_COLUMNS = (
+    "Carrier", 
+    "Origin_Warehouse", 
+    "Destination", 
+    "Shipment_Month", 
+    "Distance_miles", 
+    "Weight_kg", 
+    "Cost", 
+    "Status",
+    "Delivery_Date" 
+)
+
 # Coordinate Dictionary
 LOCATIONS = {
     # --- ORIGINS ---
@@ -93,55 +122,119 @@ LOCATIONS = {
     "Minneapolis":   {"lat": 44.9778, "lon": -93.2650}
 }
 
-ORIGIN_OPTIONS = [key for key in LOCATIONS.keys() if key.startswith("Warehouse")]
-DEST_OPTIONS = [key for key in LOCATIONS.keys() if not key.startswith("Warehouse")]
+ORIGIN_OPTIONS = tuple(key for key in LOCATIONS if key.startswith("Warehouse"))
+DEST_OPTIONS = tuple(key for key in LOCATIONS if not key.startswith("Warehouse"))
+
+# Struct-of-arrays view of LOCATIONS: lat/lon float64 arrays and a name -> index map
+LAT = np.array([v["lat"] for v in LOCATIONS.values()], dtype=np.float64)
+LON = np.array([v["lon"] for v in LOCATIONS.values()], dtype=np.float64)
+IDX = {k: i for i, k in enumerate(LOCATIONS)}
+
+def coords(name):
+    """Returns (lat, lon) for a location name."""
+    i = IDX[name]
+    return float(LAT[i]), float(LON[i])
+
+def build_distance_table():
+    """Precomputes miles for every origin x destination route (vectorized Haversine)."""
+    R = 3958.8 # Earth radius miles
+    lat = np.radians(LAT)
+    lon = np.radians(LON)
+    o = [IDX[k] for k in ORIGIN_OPTIONS]
+    d = [IDX[k] for k in DEST_OPTIONS]
+    
+    dlat = lat[d][None, :] - lat[o][:, None]
+    dlon = lon[d][None, :] - lon[o][:, None]
+    cos_lat = np.cos(lat) # one cos per location, reused for every pair
+    a = np.sin(dlat / 2)**2 + cos_lat[o][:, None] * cos_lat[d][None, :] * np.sin(dlon / 2)**2
+    # int32 (origins, destinations) matrix; clamp guards FP drift near antipodes
+    return (2 * R * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).astype(np.int32)
+
+# Lookup table: DIST_TABLE[ORIGIN_IDX[origin_name], DEST_IDX[dest_name]] -> miles
+DIST_TABLE = build_distance_table()
+ORIGIN_IDX = {k: i for i, k in enumerate(ORIGIN_OPTIONS)}
+DEST_IDX = {k: i for i, k in enumerate(DEST_OPTIONS)}
 
 # ==========================================
 # 3. HELPER FUNCTIONS
 # ==========================================
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculates approximate distance in miles (Haversine formula)."""
-    R = 3958.8 # Earth radius miles
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return int(R * c)
+def distance(origin_name, dest_name):
+    """Route distance in miles (a single table lookup)."""
+    return int(DIST_TABLE[ORIGIN_IDX[origin_name], DEST_IDX[dest_name]])
 
+def path_resolution(miles):
+    """Number of curve points for a route: short hops need fewer frames than cross-country flights."""
+    return int(np.clip(miles / 100, 8, 30))
+
+@st.cache_data(show_spinner=False, max_entries=256)
 def get_curve_points(start_lat, start_lon, end_lat, end_lon, num_points=30):
     """Generates Lat/Lon points along a curved path for the map."""
+    if start_lat == end_lat and start_lon == end_lon:
+        # Same-city shipment (e.g. Warehouse_NYC -> New York): no arc to draw
+        return np.array([[start_lon, start_lat]] * 2)
+    
     lats = np.linspace(start_lat, end_lat, num_points)
     lons = np.linspace(start_lon, end_lon, num_points)
     
     curve_factor = 5.0 # Height of the arc
-    path = []
-    for i in range(num_points):
-        progress = i / num_points
-        arc_height = math.sin(progress * math.pi) * curve_factor
-        path.append([lons[i], lats[i] + arc_height])
-        
-    return path
+    progress = np.linspace(0, 1, num_points) # reaches 1 so the arc lands on the destination
+    arc_height = np.sin(progress * np.pi) * curve_factor
+    
+    # (N, 2) array of [lon, lat] rows
+    return np.column_stack([lons, lats + arc_height])
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_path_positions(start_lat, start_lon, end_lat, end_lon, num_points=30):
+    """Converts the curved path to a list of [lon, lat] pairs."""
+    return get_curve_points(start_lat, start_lon, end_lat, end_lon, num_points).tolist()
+
+@st.cache_data(show_spinner=False)
+def build_trips_data(origin_name, dest_name):
+    """TripsLayer records for a route; timestamps index the path points."""
+    num_points = path_resolution(distance(origin_name, dest_name))
+    path = get_path_positions(*coords(origin_name), *coords(dest_name), num_points)
+    return [{"path": path, "timestamps": list(range(len(path)))}]
 
-def get_prediction(data_payload):
-    """Sends payload to Databricks Serving Endpoint."""
-    if not DATABRICKS_URL or not DATABRICKS_TOKEN:
+@st.cache_resource
+def get_session():
+    """Shared HTTP session so the Databricks TLS connection is kept alive across clicks."""
+    if not DATABRICKS_URL or HEADERS is None:
+        return None
+    
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=10,
+        # Scoring is idempotent, so POST may be retried on connect errors and gateway statuses
+        max_retries=Retry(
+            total=2,
+            read=0, # never resend a request the endpoint may still be scoring
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+def get_predictions(rows):
+    """Scores many shipments in one Databricks request (one row per shipment)."""
+    session = get_session()
+    if session is None:
         return "Error: Credentials missing. Set DATABRICKS_URL and DATABRICKS_TOKEN."
-        
-    headers = {
-        "Authorization": f"Bearer {DATABRICKS_TOKEN}", 
-        "Content-Type": "application/json"
-    }
     
     # Databricks expects specific JSON structure
-    payload = {"dataframe_split": data_payload}
+    payload = {"dataframe_split": {"columns": PAYLOAD_COLUMNS, "data": rows}}
     
     try:
-        response = requests.post(DATABRICKS_URL, headers=headers, data=json.dumps(payload))
+        response = session.post(DATABRICKS_URL, data=json_dumps(payload), timeout=(3, 15))
         if response.status_code == 200:
-            result = response.json()
+            result = json_loads(response.content)
             if 'predictions' in result:
-                return float(result['predictions'][0])
+                return [float(p) for p in result['predictions']]
             else:
                 return f"Unexpected API format: {result}"
         else:
@@ -149,6 +242,23 @@ def get_prediction(data_payload):
     except Exception as e:
         return f"Connection Failed: {e}"
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_prediction(row):
+    """Memoizes successful predictions per input row; errors raise so they are never cached."""
+    predictions = get_predictions([list(row)])
+    if isinstance(predictions, str):
+        raise RuntimeError(predictions)
+    if not predictions:
+        raise RuntimeError("Unexpected API format: empty predictions list")
+    return predictions[0]
+
+def get_prediction(row):
+    """Sends a single shipment row to Databricks Serving Endpoint (identical rows hit the cache)."""
+    try:
+        return _cached_prediction(tuple(row))
+    except RuntimeError as e:
+        return str(e)
+
 
 # ==========================================
 # 4. UI LAYOUT & MAP
@@ -165,20 +275,26 @@ col_map, col_inputs = st.columns([1.5, 1])
 with col_inputs:
     st.subheader("📦 Configure Shipment")
     
-    # Inputs
-    origin_name = st.selectbox("📍 Origin Warehouse", ORIGIN_OPTIONS, index=0)
-    dest_name = st.selectbox("🏁 Destination City", DEST_OPTIONS, index=1)
+    # Inputs (batched in a form: dragging/typing doesn't rerun the script until "Update" or "Predict")
+    with st.form("shipment"):
+        # Integer options keep widget state small; names are looked up from the option tuples below
+        origin_i = st.selectbox("📍 Origin Warehouse", range(len(ORIGIN_OPTIONS)), index=0, format_func=ORIGIN_OPTIONS.__getitem__)
+        dest_i = st.selectbox("🏁 Destination City", range(len(DEST_OPTIONS)), index=1, format_func=DEST_OPTIONS.__getitem__)
+        
+        weight = st.slider("Weight (kg)", 1, 1000, 150)
+        courier = st.selectbox("Courier", ["FedEx", "DHL", "UPS", "USPS", "OnTrac", "Amazon Logistics", "LaserShip"])
+        
+        # Date Input
+        delivery_date = st.date_input("Shipment Start Date", value=date.today())
+        
+        st.form_submit_button("🔄 Update Shipment", width="stretch")
+        
+        # ACTION BUTTON (also submits the form, so the prediction uses exactly what is on screen)
+        predict_btn = st.form_submit_button("🚀 Let's Predict Transit Time", type="primary", width="stretch")
     
     # Calculations
-    origin_coords = LOCATIONS[origin_name]
-    dest_coords = LOCATIONS[dest_name]
-    real_distance = calculate_distance(origin_coords['lat'], origin_coords['lon'], dest_coords['lat'], dest_coords['lon'])
-    
-    weight = st.slider("Weight (kg)", 1, 1000, 150)
-    courier = st.selectbox("Courier", ["FedEx", "DHL", "UPS", "USPS", "OnTrac", "Amazon Logistics", "LaserShip"])
-    
-    # Date Input
-    delivery_date = st.date_input("Shipment Start Date", value=date.today())
+    origin_name, dest_name = ORIGIN_OPTIONS[origin_i], DEST_OPTIONS[dest_i]
+    real_distance = distance(origin_name, dest_name)
     
     # Rough cost estimate logic
     cost = (real_distance * 0.1) + (weight * 0.5)
@@ -195,71 +311,144 @@ with col_inputs:
         </div>
         <br>
     """, unsafe_allow_html=True)
-    
-    # ACTION BUTTON
-    predict_btn = st.button("🚀 Let's Predict Transit Time", type="primary", use_container_width=True)
 
 # --- MAP VISUALIZATION SETUP ---
 
-# 1. Generate Path
-path_points = get_curve_points(origin_coords["lat"], origin_coords["lon"], dest_coords["lat"], dest_coords["lon"])
-df_path = pd.DataFrame(path_points, columns=["lon", "lat"])
+# 1. View State (Centered)
+@st.cache_resource(show_spinner=False)
+def build_view_state(origin_name, dest_name):
+    """Camera centered between origin and destination, reused while the route is unchanged."""
+    origin_lat, origin_lon = coords(origin_name)
+    dest_lat, dest_lon = coords(dest_name)
+    mid_lat = (origin_lat + dest_lat) / 2
+    mid_lon = (origin_lon + dest_lon) / 2
+    return pdk.ViewState(latitude=mid_lat, longitude=mid_lon, zoom=3, pitch=45)
 
-# 2. View State (Centered)
-mid_lat = (origin_coords["lat"] + dest_coords["lat"]) / 2
-mid_lon = (origin_coords["lon"] + dest_coords["lon"]) / 2
-view_state = pdk.ViewState(latitude=mid_lat, longitude=mid_lon, zoom=3, pitch=45)
-
-# 3. Icon Data (Airplane)
-icon_data = {
+# 2. Icon Data (Airplane)
+ICON_DATA = {
     "url": "https://cdn-icons-png.flaticon.com/512/723/723955.png", # White Plane Icon
     "width": 128, "height": 128, "anchorY": 128
 }
 
-def render_map(current_plane_pos):
-    """Returns a PyDeck object with the static path + dynamic plane position."""
+@st.cache_resource(show_spinner=False)
+def build_static_layers(origin_name, dest_name):
+    """Builds the route layers that never change for a given origin/destination."""
+    origin_lat, origin_lon = coords(origin_name)
+    dest_lat, dest_lon = coords(dest_name)
+    num_points = path_resolution(distance(origin_name, dest_name))
+    path = get_path_positions(origin_lat, origin_lon, dest_lat, dest_lon, num_points)
+    return [
+        # A. Cities (Green/Red dots)
+        pdk.Layer(
+            "ScatterplotLayer",
+            data=[
+                {"lon": origin_lon, "lat": origin_lat, "color": [0, 255, 0], "radius": 80000},
+                {"lon": dest_lon, "lat": dest_lat, "color": [255, 0, 0], "radius": 80000}
+            ],
+            get_position="[lon, lat]",
+            get_fill_color="color",
+            get_radius="radius",
+        ),
+        # B. The Dotted Path
+        pdk.Layer(
+            "ScatterplotLayer",
+            data=path,
+            get_position="-", # each datum is already a [lon, lat] pair
+            get_fill_color=[200, 200, 200, 150],
+            get_radius=30000,
+        ),
+    ]
+
+@st.cache_resource(show_spinner=False)
+def build_trip_layer(origin_name, dest_name):
+    """Builds the flight-trail layer for a route (rendered client-side by deck.gl's TripsLayer)."""
+    trips_data = build_trips_data(origin_name, dest_name)
+    return pdk.Layer(
+        "TripsLayer",
+        data=trips_data,
+        get_path="path",
+        get_timestamps="timestamps",
+        get_color=[0, 255, 0],
+        width_min_pixels=4,
+        trail_length=180,
+        current_time=0, # TRIP_ANIMATION_JS advances the clock in the browser
+    )
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def build_deck(origin_name, dest_name, show_trip=False):
+    """Returns a PyDeck object with the static path + plane (at the origin, or landed with its trail)."""
+    plane_lat, plane_lon = coords(dest_name if show_trip else origin_name)
+    layers = build_static_layers(origin_name, dest_name) + [
+        # C. The Moving Airplane
+        pdk.Layer(
+            "IconLayer",
+            data=[{"lon": plane_lon, "lat": plane_lat, "icon": ICON_DATA}],
+            get_icon="icon",
+            get_size=4,
+            size_scale=15,
+            get_position="[lon, lat]",
+            pickable=True
+        )
+    ]
+    
+    if show_trip:
+        # D. Flight Trail
+        layers.append(build_trip_layer(origin_name, dest_name))
+    
     return pdk.Deck(
-        layers=[
-            # A. Cities (Green/Red dots)
-            pdk.Layer(
-                "ScatterplotLayer",
-                data=[
-                    {"lon": origin_coords["lon"], "lat": origin_coords["lat"], "color": [0, 255, 0], "radius": 80000},
-                    {"lon": dest_coords["lon"], "lat": dest_coords["lat"], "color": [255, 0, 0], "radius": 80000}
-                ],
-                get_position="[lon, lat]",
-                get_fill_color="color",
-                get_radius="radius",
-            ),
-            # B. The Dotted Path
-            pdk.Layer(
-                "ScatterplotLayer",
-                data=df_path,
-                get_position="[lon, lat]",
-                get_fill_color=[200, 200, 200, 150],
-                get_radius=30000,
-            ),
-            # C. The Moving Airplane
-            pdk.Layer(
-                "IconLayer",
-                data=current_plane_pos,
-                get_icon=lambda x: icon_data,
-                get_size=4,
-                size_scale=15,
-                get_position="[lon, lat]",
-                pickable=True
-            )
-        ],
-        initial_view_state=view_state,
+        layers=layers,
+        initial_view_state=build_view_state(origin_name, dest_name),
         map_style=pdk.map_styles.CARTO_DARK # Crucial for Dark Mode visibility
     )
 
+# Client-side clock for the TripsLayer: one HTML payload, deck.gl advances the frames
+TRIP_ANIMATION_JS = """
+<script>
+  (function () {{
+    const end = {end};
+    let t = 0;
+    function setTime(time) {{
+      jsonInput.layers.forEach(function (layer) {{
+        if (layer["@@type"] === "TripsLayer") layer.currentTime = time;
+      }});
+    }}
+    function tick() {{
+      t = Math.min(t + {step}, end);
+      setTime(t);
+      updateDeck(jsonInput, deckInstance);
+      if (t < end) requestAnimationFrame(tick);
+    }}
+    if (typeof updateDeck === "function") {{
+      requestAnimationFrame(tick);
+    }} else {{
+      // No updateDeck: rebuild the deck once with the trail drawn in full
+      setTime(end);
+      if (deckInstance && deckInstance.finalize) deckInstance.finalize();
+      createDeck({{container, jsonInput, tooltip, customLibraries, configuration}});
+    }}
+  }})();
+</script>
+</html>
+"""
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_deck_html(origin_name, dest_name, show_trip=False, duration_frames=36):
+    """Serializes the cached deck to standalone HTML once per route (plus the trail animation when shown)."""
+    html = build_deck(origin_name, dest_name, show_trip).to_html(as_string=True)
+    if not show_trip:
+        return html
+    
+    end = len(build_trips_data(origin_name, dest_name)[0]["timestamps"])
+    # Append after pydeck's own <script> so jsonInput/deckInstance already exist
+    head, sep, _ = html.rpartition("</html>")
+    return (head if sep else html) + TRIP_ANIMATION_JS.format(end=end, step=end / duration_frames)
+
 # Create a placeholder for the map to update inside
 map_placeholder = col_map.empty()
 
 # Show initial map (plane at origin)
-initial_pos = pd.DataFrame([{"lon": origin_coords["lon"], "lat": origin_coords["lat"]}])
-map_placeholder.pydeck_chart(render_map(initial_pos))
+# Embedded as raw HTML so deck.gl reads the data directly instead of via st.pydeck_chart's protocol
+map_placeholder.iframe(build_deck_html(origin_name, dest_name), height=500)
 
 
 # ==========================================
@@ -268,47 +457,25 @@ map_placeholder.pydeck_chart(render_map(initial_pos))
 
 if predict_btn:
     
-    # A. Run Animation
-    with st.spinner("Analyzing Logistics Route..."):
-        step_size = 1 
-        # Loop through points to move the plane
-        for i in range(0, len(path_points), step_size):
-            current_pos = pd.DataFrame([{"lon": path_points[i][0], "lat": path_points[i][1]}])
-            map_placeholder.pydeck_chart(render_map(current_pos))
-            time.sleep(0.02) # Speed of animation
-            
-        # Ensure plane lands at exact destination
-        final_pos = pd.DataFrame([{"lon": dest_coords["lon"], "lat": dest_coords["lat"]}])
-        map_placeholder.pydeck_chart(render_map(final_pos))
-
-    # B. Prepare Payload
-    input_data = {
-        "columns": [
-            "Carrier", 
-            "Origin_Warehouse", 
-            "Destination", 
-            "Shipment_Month", 
-            "Distance_miles", 
-            "Weight_kg", 
-            "Cost", 
-            "Status",
-            "Delivery_Date" 
-        ],
-        "data": [[
-            courier, 
-            origin_name, 
-            dest_name, 
-            "December",      
-            real_distance, 
-            weight, 
-            cost, 
-            "On Time",
-            str(delivery_date)
-        ]]
-    }
+    # A. Prepare Payload (one row, ordered as PAYLOAD_COLUMNS)
+    input_data = [
+        courier, 
+        origin_name, 
+        dest_name, 
+        calendar.month_name[delivery_date.month],      
+        real_distance, 
+        weight, 
+        cost, 
+        "On Time",
+        str(delivery_date)
+    ]
     
-    # C. Call API
-    prediction = get_prediction(input_data)
+    # B. Draw Flight (one HTML embed; the trail is animated in the browser, not per-frame from Python)
+    map_placeholder.iframe(build_deck_html(origin_name, dest_name, show_trip=True), height=500)
+    
+    # C. Call API (the browser animates the trail while this waits)
+    with st.spinner("Analyzing Logistics Route..."):
+        prediction = get_prediction(input_data)
     
     # D. Display Results
     if isinstance(prediction, (int, float)):